@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2020 Xvezda <xvezda@naver.com>
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+from __future__ import absolute_import
+
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from vishop.core import (VishopError, ZIP_CODECS, FileItem, build_bundle,
+                         bundle_sink, minify_stage, prefetch,
+                         source_date_epoch, write_tar_bundle,
+                         write_zip_bundle)
+
+
+def make_items(root):
+    contents = {
+        'plugin/foo.vim': b'let g:foo = 1\n' * 100,
+        'doc/foo.txt': b'*foo.txt*\n',
+        'README.md': b'',
+    }
+    items = []
+    for name, content in sorted(contents.items()):
+        path = os.path.join(str(root), name)
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError:
+            pass
+        with open(path, 'wb') as f:
+            f.write(content)
+        items.append(FileItem(path))
+    return items, contents
+
+
+def test_tar_reproducible(tmpdir, monkeypatch):
+    monkeypatch.setenv('SOURCE_DATE_EPOCH', '1600000000')
+    items, _ = make_items(tmpdir.join('src'))
+    paths = [item.path for item in items]
+    bundles = []
+    for i, mtime in enumerate([1000000000, 1500000000]):
+        for path in paths:
+            os.utime(path, (mtime, mtime))
+        bundle_path = str(tmpdir.join('bundle%d.tar.gz' % i))
+        write_tar_bundle(bundle_path, prefetch(paths), 'gz',
+                         mtime=source_date_epoch())
+        with open(bundle_path, 'rb') as f:
+            bundles.append(f.read())
+    assert bundles[0] == bundles[1]
+
+    with tarfile.open(fileobj=io.BytesIO(bundles[0])) as f:
+        for info in f.getmembers():
+            assert info.mtime == 1600000000
+            assert (info.uid, info.gid, info.uname, info.gname) == (
+                0, 0, '', '')
+
+
+def test_tar_dedupe(tmpdir):
+    src = tmpdir.join('src')
+    src.ensure(dir=True)
+    for name in ['a.vim', 'b.vim']:
+        src.join(name).write_binary(b'echo 1\n')
+    src.join('c.vim').write_binary(b'echo 2\n')
+    paths = [str(src.join(name)) for name in ['a.vim', 'b.vim', 'c.vim']]
+    bundle_path = str(tmpdir.join('bundle.tar'))
+    write_tar_bundle(bundle_path, prefetch(paths), '', dedupe=True)
+
+    with tarfile.open(bundle_path) as f:
+        a, b, c = f.getmembers()
+        assert a.isreg() and c.isreg()
+        assert b.type == tarfile.LNKTYPE
+        assert b.linkname == a.name
+        assert f.extractfile(b).read() == b'echo 1\n'
+        assert f.extractfile(c).read() == b'echo 2\n'
+
+
+@pytest.mark.parametrize('codec', list(ZIP_CODECS))
+def test_zip_round_trip(tmpdir, codec):
+    if codec == 'lzma' and not hasattr(zipfile, 'LZMACompressor'):
+        pytest.skip('lzma is not supported')
+    items, contents = make_items(tmpdir.join('src'))
+    bundle_path = str(tmpdir.join('bundle.zip'))
+    write_zip_bundle(bundle_path, items, codec=codec, jobs=2)
+
+    with zipfile.ZipFile(bundle_path) as f:
+        assert f.testzip() is None
+        for name, content in contents.items():
+            path = str(tmpdir.join('src', name)).lstrip(os.sep)
+            assert f.read(path.replace(os.sep, '/')) == content
+
+
+def test_zip_reproducible(tmpdir):
+    items, _ = make_items(tmpdir.join('src'))
+    first = str(tmpdir.join('first.zip'))
+    second = str(tmpdir.join('second.zip'))
+    write_zip_bundle(first, items, mtime=0, jobs=1)
+    write_zip_bundle(second, items, mtime=0, jobs=4)
+    with open(first, 'rb') as f, open(second, 'rb') as g:
+        assert f.read() == g.read()
+
+
+@pytest.mark.parametrize('codec, level', [
+    ('deflate', 12),
+    ('deflate', -2),
+    ('bzip2', 0),
+])
+def test_zip_invalid_level(tmpdir, codec, level):
+    items, _ = make_items(tmpdir.join('src'))
+    with pytest.raises(VishopError):
+        write_zip_bundle(str(tmpdir.join('bundle.zip')), items,
+                         codec=codec, level=level)
+
+
+@pytest.mark.skipif(not hasattr(os, 'symlink'), reason='no symlink')
+def test_zip_minify_symlink(tmpdir):
+    tmpdir.join('plugin').ensure(dir=True)
+    tmpdir.join('autoload').ensure(dir=True)
+    tmpdir.join('plugin', 'a.vim').write_binary(b'" comment\necho 1\n')
+    os.symlink(os.path.join('..', 'plugin', 'a.vim'),
+               str(tmpdir.join('autoload', 'link.vim')))
+    files = [str(tmpdir.join('plugin', 'a.vim')),
+             str(tmpdir.join('autoload', 'link.vim'))]
+    bundle_path = str(tmpdir.join('bundle.zip'))
+    build_bundle(files, bundle_sink(bundle_path, 'zip'),
+                 stages=[lambda items: minify_stage(items,
+                                                    str(tmpdir.join('cache')))])
+
+    with zipfile.ZipFile(bundle_path) as f:
+        assert [f.read(info) for info in f.infolist()] == [b'echo 1\n'] * 2
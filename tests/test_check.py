@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2020 Xvezda <xvezda@naver.com>
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+from __future__ import absolute_import
+
+import io
+import os
+import json
+import tarfile
+import zipfile
+
+from vishop.core import (CONFIG_FILENAME, SCRIPT_TYPES, VIM_VERSIONS,
+                         check_bundle)
+
+
+CONFIG = json.dumps({
+    'name': 'foo',
+    'type': SCRIPT_TYPES[0],
+    'version': '1.0',
+    'required': VIM_VERSIONS[0],
+    'summary': 'foo',
+}).encode('utf8')
+
+
+def add_file(f, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    f.addfile(info, io.BytesIO(data))
+
+
+def add_link(f, name, target, type_=tarfile.SYMTYPE):
+    info = tarfile.TarInfo(name)
+    info.type = type_
+    info.linkname = target
+    f.addfile(info)
+
+
+def write_tar(path, mode='w:gz', members=()):
+    with tarfile.open(path, mode) as f:
+        add_file(f, CONFIG_FILENAME, CONFIG)
+        add_file(f, 'README.md', b'# foo\n')
+        for member in members:
+            member(f)
+    return path
+
+
+def test_valid_bundle(tmpdir):
+    path = write_tar(str(tmpdir.join('foo.tar.gz')), members=[
+        lambda f: add_file(f, 'plugin/a.vim', b'echo 1\n'),
+        lambda f: add_link(f, 'autoload/link.vim', '../plugin/a.vim'),
+        lambda f: add_link(f, 'plugin/b.vim', 'plugin/a.vim', tarfile.LNKTYPE),
+    ])
+    report = check_bundle(path)
+    assert report['errors'] == []
+    assert report['warnings'] == []
+
+
+def test_compression_mismatch(tmpdir):
+    path = write_tar(str(tmpdir.join('foo.tar.gz')), mode='w')
+    errors = check_bundle(path)['errors']
+    assert errors == ['bundle compression mismatch: '
+                      'expected gz, found uncompressed']
+
+
+def test_unsafe_member_path(tmpdir):
+    path = write_tar(str(tmpdir.join('foo.tar.gz')), members=[
+        lambda f: add_file(f, '../evil.vim', b'echo 1\n'),
+    ])
+    assert check_bundle(path)['errors'] == [
+        "unsafe member path '../evil.vim'"]
+
+
+def test_unsafe_link_target(tmpdir):
+    path = write_tar(str(tmpdir.join('foo.tar.gz')), members=[
+        lambda f: add_link(f, 'plugin/a.vim', '../../etc/passwd'),
+        lambda f: add_link(f, 'plugin/b.vim', '/etc/passwd'),
+        lambda f: add_link(f, 'plugin/c.vim', '../plugin/a.vim',
+                           tarfile.LNKTYPE),
+    ])
+    assert check_bundle(path)['errors'] == [
+        "unsafe link target '../../etc/passwd' of 'plugin/a.vim'",
+        "unsafe link target '/etc/passwd' of 'plugin/b.vim'",
+        "unsafe link target '../plugin/a.vim' of 'plugin/c.vim'",
+    ]
+
+
+def test_duplicated_member(tmpdir):
+    path = write_tar(str(tmpdir.join('foo.tar')), mode='w', members=[
+        lambda f: add_file(f, 'plugin/a.vim', b'echo 1\n'),
+        lambda f: add_file(f, 'plugin/a.vim', b'echo 2\n'),
+    ])
+    assert check_bundle(path)['errors'] == [
+        "duplicated member 'plugin/a.vim'"]
+
+
+def test_missing_config_and_readme(tmpdir):
+    path = str(tmpdir.join('foo.tar.gz'))
+    with tarfile.open(path, 'w:gz') as f:
+        add_file(f, 'plugin/a.vim', b'echo 1\n')
+    assert check_bundle(path)['errors'] == [
+        "cannot find '%s' from bundle" % CONFIG_FILENAME,
+        'README not found and no description configured',
+    ]
+
+
+def test_unreadable_bundle(tmpdir):
+    report = check_bundle(str(tmpdir.join('missing.tar.gz')))
+    assert len(report['errors']) == 1
+    assert report['errors'][0].startswith('cannot read bundle:')
+
+
+def test_stored_zip_warning(tmpdir):
+    path = str(tmpdir.join('foo.zip'))
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED) as f:
+        f.writestr(CONFIG_FILENAME, CONFIG)
+        f.writestr('README.md', b'# foo\n')
+    report = check_bundle(path)
+    assert report['errors'] == []
+    assert report['warnings'] == ['zip members are not compressed']
+
+
+def test_gz_member_compressed_sizes(tmpdir):
+    # Incompressible members, so each one owns a fair share of bundle
+    members = [
+        (lambda i: lambda f: add_file(f, 'plugin/%d.vim' % i,
+                                      os.urandom(200 * 1024)))(i)
+        for i in range(3)
+    ]
+    path = write_tar(str(tmpdir.join('foo.tar.gz')), members=members)
+    report = check_bundle(path)
+    assert report['errors'] == []
+    sizes = dict((member['name'], member['compressed_size'])
+                 for member in report['members'])
+    for i in range(3):
+        assert 200 * 1024 <= sizes['plugin/%d.vim' % i] < 210 * 1024
+    total = sum(sizes.values())
+    # Only tar headers, padding and gzip framing are left unaccounted
+    assert total <= report['size'] < total + 10 * 1024
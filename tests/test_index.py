@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2020 Xvezda <xvezda@naver.com>
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+from __future__ import absolute_import
+
+import os
+import sys
+import time
+
+import pytest
+
+from vishop.core import ScriptIndex, main
+
+
+def information(*scripts):
+    return {
+        'user_name': 'foo',
+        'first_name': 'Foo',
+        'last_name': 'Bar',
+        'email': 'foo@example.com',
+        'scripts': [{'id': str(script_id), 'name': name, 'summary': name}
+                    for script_id, name in scripts],
+    }
+
+
+@pytest.fixture
+def index(tmpdir):
+    index = ScriptIndex(str(tmpdir.join('index.sqlite3')))
+    yield index
+    index.close()
+
+
+def test_store_info_drops_unlisted_scripts(index):
+    index.store_info(information((1, 'a'), (2, 'b')))
+    index.store_versions(2, [{'version': '1.0'}])
+    index.store_info(information((1, 'a')))
+
+    assert index.script_names() == ['a']
+    assert index.versions('b') is None
+    assert index.infos()[0]['scripts'] == [
+        {'id': '1', 'name': 'a', 'summary': 'a'}]
+    count, = index.connection.execute(
+        'SELECT COUNT(*) FROM versions').fetchone()
+    assert count == 0
+
+
+def test_stale_scripts(index):
+    index.store_info(information((1, 'a'), (2, 'b'), (3, 'c')))
+    index.store_versions(1, [{'version': '1.0'}])
+    index.store_versions(2, [{'version': '1.0'}])
+    with index.connection as c:
+        c.execute('UPDATE scripts SET versions_updated_at = ? WHERE id = 2',
+                  (time.time() - 2 * 60 * 60,))
+
+    assert sorted(index.stale_scripts(60 * 60)) == [2, 3]
+    assert sorted(index.stale_scripts(3 * 60 * 60)) == [3]
+    assert sorted(index.stale_scripts()) == [1, 2, 3]
+    # Versions stored again are kept after refresh of account
+    index.store_info(information((1, 'a'), (2, 'b'), (3, 'c')))
+    assert sorted(index.stale_scripts(60 * 60)) == [2, 3]
+
+
+def test_add_version(index):
+    index.store_info(information((1, 'a'), (2, 'b')))
+    index.store_versions(1, [{'version': '1.0'}])
+
+    assert index.add_version('a', {'version': '1.1'})
+    assert [version['version'] for version in index.versions('a')] == [
+        '1.1', '1.0']
+    assert sorted(index.stale_scripts(60 * 60)) == [1, 2]
+    # Not indexed yet
+    assert not index.add_version('b', {'version': '1.0'})
+    assert not index.add_version('c', {'version': '1.0'})
+
+
+@pytest.mark.parametrize('action', ['info', 'versions'])
+def test_query_missing_index(tmpdir, monkeypatch, capsys, action):
+    path = str(tmpdir.join('index.sqlite3'))
+    monkeypatch.setattr(sys, 'argv', ['vishop', 'index', action,
+                                      '--index', path])
+    assert main() == 1
+    assert 'no index found' in capsys.readouterr().err
+    assert not os.path.exists(path)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2020 Xvezda <xvezda@naver.com>
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+from __future__ import absolute_import
+
+from vishop.core import minify_vim
+
+
+def test_strip_comments_and_blank_lines():
+    source = b'" comment\n\nlet g:x = 1\n   " indented\necho g:x\n'
+    assert minify_vim(source) == b'let g:x = 1\necho g:x\n'
+
+
+def test_keep_line_before_continuation():
+    source = (b'let x = [\n'
+              b'      \\ 1,\n'
+              b'      " comment\n'
+              b'      \\ 2]\n')
+    assert minify_vim(source) == source
+
+
+def test_keep_let_heredoc():
+    source = b'let s:t =<< trim END\n  " text\n\n  END\n" comment\n'
+    assert minify_vim(source) == b'let s:t =<< trim END\n  " text\n\n  END\n'
+
+
+def test_keep_heredoc_after_modifier():
+    source = (b'silent! python3 << EOF\n'
+              b'def f():\n'
+              b'    """doc"""\n'
+              b'\n'
+              b'    return 1\n'
+              b'EOF\n'
+              b'" comment\n')
+    assert minify_vim(source) == source[:-len(b'" comment\n')]
+
+
+def test_keep_heredoc_after_bar():
+    source = (b"if has('python3') | python3 << EOF\n"
+              b'"""doc"""\n'
+              b'EOF\n'
+              b'endif\n')
+    assert minify_vim(source) == source
+
+
+def test_keep_heredoc_with_default_marker():
+    source = b'sil py3 <<\n"text"\n\n.\n'
+    assert minify_vim(source) == source
+
+
+def test_untouched_with_unrecognized_heredoc():
+    source = b'" comment\nexe "python3 << EOF\\n" . code\n'
+    assert minify_vim(source) == source
+
+
+def test_untouched_with_append():
+    for command in [b'append', b'a', b'insert', b'i!', b'change',
+                    b'1,2c', b"silent $append"]:
+        source = b'" comment\n' + command + b'\n" text\n.\n'
+        assert minify_vim(source) == source
+
+
+def test_keep_after_finish():
+    source = b'let x = 1\nfinish\n" data\n'
+    assert minify_vim(source) == source
+
+
+def test_untouched_vim9script():
+    source = b'vim9script\n# comment\n\n"string"\n'
+    assert minify_vim(source) == source
+
+
+def test_untouched_def_function():
+    source = (b'" comment\n'
+              b'def Foo()\n'
+              b'  "abc"->setline(1)\n'
+              b'enddef\n')
+    assert minify_vim(source) == source
+    source = b'export def Foo()\n  "abc"->setline(1)\nenddef\n'
+    assert minify_vim(source) == source
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2020 Xvezda <xvezda@naver.com>
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+from __future__ import absolute_import
+
+import argparse
+
+import pytest
+
+from vishop import core
+from vishop.core import ScriptIndex, VishopError, prepare_bundle
+
+
+@pytest.mark.parametrize('name, content', [
+    ('missing.tar.gz', None),
+    ('corrupted.tar.gz', b'not a tar'),
+    ('corrupted.zip', b'not a zip'),
+])
+def test_prepare_unreadable_bundle(tmpdir, name, content):
+    path = tmpdir.join(name)
+    if content is not None:
+        path.write_binary(content)
+    with pytest.raises(VishopError) as excinfo:
+        prepare_bundle(str(path))
+    assert str(excinfo.value).startswith("cannot read bundle '%s': " % path)
+
+
+class FakeClient(object):
+    def __init__(self, published):
+        self.published = published
+
+    def fetch_scripts(self):
+        return []
+
+    def publish(self, bundles, scripts):
+        self.published.extend(bundle['path'] for bundle in bundles)
+
+
+@pytest.fixture
+def publish(tmpdir, monkeypatch):
+    path = str(tmpdir.join('index.sqlite3'))
+    index = ScriptIndex(path)
+    index.store_info({'user_name': 'foo',
+                      'scripts': [{'id': '1', 'name': 'a'}]})
+    index.store_versions(1, [{'version': '1.0'}])
+    index.close()
+
+    logins = []
+    published = []
+
+    def login(self, account):
+        logins.append(account)
+        return FakeClient(published)
+
+    monkeypatch.setattr(core, 'load_credentials', lambda path: {})
+    monkeypatch.setattr(core.VishopClientPool, 'client',
+                        lambda self, account: None)
+    monkeypatch.setattr(core.VishopClientPool, 'login', login)
+    monkeypatch.setattr(core, 'prepare_bundle', lambda file, config: {
+        'path': file,
+        'config': {'name': file.split('-')[0], 'version': file.split('-')[1],
+                   'account': None},
+    })
+
+    def run(*files):
+        args = argparse.Namespace(files=list(files), config=None, jobs=2,
+                                  credentials=None, index=path,
+                                  no_index=False)
+        core._publish_command(args)
+    run.path = path
+    run.logins = logins
+    run.published = published
+    return run
+
+
+def test_publish_conflict_before_login(publish):
+    with pytest.raises(VishopError):
+        publish('b-1.0', 'a-1.0')
+    assert publish.logins == []
+    assert publish.published == []
+
+
+def test_publish_updates_index(publish):
+    publish('a-1.1', 'b-1.0')
+    assert publish.published == ['a-1.1', 'b-1.0']
+    index = ScriptIndex(publish.path)
+    try:
+        assert [version['version'] for version in index.versions('a')] == [
+            '1.1', '1.0']
+    finally:
+        index.close()
+    with pytest.raises(VishopError):
+        publish('a-1.1')
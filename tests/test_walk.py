@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2020 Xvezda <xvezda@naver.com>
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+from __future__ import absolute_import
+
+import os
+
+import pytest
+
+from vishop.core import walk_files
+
+
+@pytest.fixture
+def root(tmpdir):
+    root = tmpdir.join('root')
+    root.join('plugin').ensure(dir=True)
+    root.join('doc').ensure(dir=True)
+    root.join('plugin', 'a.vim').write_binary(b'echo 1\n')
+    root.join('doc', 'a.txt').write_binary(b'*a.txt*\n')
+    root.join('.hidden').write_binary(b'')
+    return root
+
+
+def test_walk_single_root(root):
+    assert list(walk_files([str(root)])) == [
+        str(root.join('doc', 'a.txt')),
+        str(root.join('plugin', 'a.vim')),
+    ]
+
+
+@pytest.mark.skipif(not hasattr(os, 'symlink') or not hasattr(os, 'link'),
+                    reason='no symlink or hard link')
+def test_walk_overlapping_roots(tmpdir, root):
+    os.link(str(root.join('plugin', 'a.vim')),
+            str(root.join('plugin', 'hard.vim')))
+    os.symlink(str(root), str(tmpdir.join('alias')))
+
+    roots = [str(root), str(root.join('plugin')), str(tmpdir.join('alias'))]
+    assert list(walk_files(roots)) == [
+        str(root.join('doc', 'a.txt')),
+        str(root.join('plugin', 'a.vim')),
+        str(root.join('plugin', 'hard.vim')),
+    ]
+    # Order of roots decides which path of duplicated file is kept
+    roots = [str(root.join('plugin')), str(root)]
+    assert list(walk_files(roots)) == [
+        str(root.join('plugin', 'a.vim')),
+        str(root.join('plugin', 'hard.vim')),
+        str(root.join('doc', 'a.txt')),
+    ]
@@ -7,9 +7,11 @@
 # https://opensource.org/licenses/MIT.
 
 
+import sys
+
 from .core import main
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
 
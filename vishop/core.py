@@ -10,12 +10,32 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import io
 import re
 import os
 import sys
+import gzip
 import json
+import stat
+import time
+import zlib
+import struct
+import posixpath
+import hashlib
+import contextlib
 import tarfile
 import zipfile
+import threading
+import itertools
+import collections
+
+try:
+    from os import scandir
+except ImportError:  # Python 2
+    try:
+        from scandir import scandir  # noqa
+    except ImportError:
+        scandir = None
 
 import requests  # noqa
 from bs4 import BeautifulSoup  # noqa
@@ -28,11 +48,34 @@ from .__about__ import __title__, __version__, __author__, __email__  # noqa
 
 CONFIG_FILENAME = '%s.json' % __title__
 
+SCRIPT_TYPES = [
+    'color scheme',
+    'ftplugin',
+    'game',
+    'indent',
+    'syntax',
+    'utility',
+    'patch'
+]
+
+VIM_VERSIONS = [
+    '5.7',
+    '6.0',
+    '7.0',
+    '7.2',
+    '7.3',
+    '7.4',
+    '8.0'
+]
+
 PY2 = sys.version_info[0] == 2
 PY3 = sys.version_info[0] == 3
 
 if PY2:
     input = raw_input  # noqa
+    import Queue as queue  # noqa
+else:
+    import queue
 
 def u(text):
     if PY2:
@@ -44,8 +87,17 @@ def urljoin(*args):
     return '/'.join(args)
 
 
+# Serializes prompts of concurrent publishes
+_prompt_lock = threading.Lock()
+
+
+def prompt(message):
+    with _prompt_lock:
+        return input(message)
+
+
 def confirm(message):
-    answer = input(message)
+    answer = prompt(message)
     if answer.lower().startswith('y'):
         return True
     return False
@@ -97,50 +149,43 @@ class VishopClient(BaseClient):
     #
     # Using decorator?
 
-    def __init__(self, args=None):
+    def __init__(self, args=None, username=None, password=None,
+                 account=None):
         super(VishopClient, self).__init__()
         self.update_headers({
             'User-Agent': self.USER_AGENT
         })
 
         self.args = args
+        self.account = account
+        self.logged_in = False
 
-        self.username = args.username or os.getenv('VISHOP_USERNAME')
-        self.password = args.password or os.getenv('VISHOP_PASSWORD')
+        if account is None:
+            username = (username or args.username
+                        or os.getenv('VISHOP_USERNAME'))
+            password = (password or args.password
+                        or os.getenv('VISHOP_PASSWORD'))
+        self.username = username
+        self.password = password
 
         if (not sys.stdin.isatty()
                 and (not self.username or not self.password)):
             raise VishopError('username or password required')
 
+        label = '' if account is None else ' of %s' % account
         if not self.username:
-            self.username = input('username or email: ')
+            self.username = prompt('username or email%s: ' % label)
 
         if not self.password:
             import getpass
-            self.password = getpass.getpass('password: ')
+            with _prompt_lock:
+                self.password = getpass.getpass('password%s: ' % label)
 
     def file_from_bundle(self, bundle_path, file):
-        wildcard_filter = lambda x: re.search(wildcard(escape(file)), x)
-        if re.search(r'\.tar\.[a-z]+$', bundle_path):  # tar file
-            with tarfile.TarFile(bundle_path, 'r') as f:
-                files = list(filter(wildcard_filter, f.getnames()))
-                try:
-                    file = files[0]  # First match
-                except IndexError:
-                    raise VishopError('cannot find file from bundle')
-                return f.extractfile(file).read()
-        elif re.search(r'\.zip$', bundle_path):  # zip file
-            with zipfile.ZipFile(bundle_path, 'r') as f:
-                files = list(filter(wildcard_filter, f.namelist()))
-                try:
-                    file = files[0]  # First match
-                except IndexError:
-                    raise VishopError('cannot find file from bundle')
-                return f.read(file)
-        raise VishopError("file '%s' is not supported type" % bundle_path)
+        return file_from_bundle(bundle_path, file)
 
     def config_from_bundle(self, path):
-        return json.loads(self.file_from_bundle(path, self.args.config))
+        return config_from_bundle(path, self.args.config)
 
     def readme_from_bundle(self, path):
         return self.file_from_bundle(path, 'README*')
@@ -188,19 +233,11 @@ class VishopClient(BaseClient):
         # Login failed
         if re.search('Authentication failed', r.text):
             raise VishopError('authentication failed')
+        self.logged_in = True
         print('login success!')
 
     def info(self):
-        information = self.fetch_info()
-
-        print('user name:', information.get('user_name'))
-        print('first name:', information.get('first_name'))
-        print('last name:', information.get('last_name'))
-        print('email:', information.get('email'))
-
-        print('scripts:')
-        for script in information.get('scripts', []):
-            print(' '*2 + '%s: %s' % (script.get('name'), script.get('summary')))
+        print_info(self.fetch_info())
 
     def fetch_info(self):
         ret = {}
@@ -249,6 +286,9 @@ class VishopClient(BaseClient):
         return info['scripts']
 
     def versions(self, script_id):
+        return [row['version'] for row in self.version_history(script_id)]
+
+    def version_history(self, script_id):
         # https://www.vim.org/scripts/script.php?script_id=[id]
         url = urljoin(self.BASE_URL, 'scripts', 'script.php?script_id=%d' % int(script_id))
         r = requests.get(url, headers=self.headers)
@@ -270,7 +310,14 @@ class VishopClient(BaseClient):
                 package, version, date, required, user, note = row.find_all('td')
             except ValueError:  # If there is more than 1 script versions, deleting button appears.
                 _, package, version, date, required, user, note = row.find_all('td')
-            ret.append(version.string)
+            ret.append({
+                'package': package.get_text().strip(),
+                'version': version.string,
+                'date': date.get_text().strip(),
+                'required': required.get_text().strip(),
+                'user': user.get_text().strip(),
+                'note': note.get_text().strip()
+            })
         return ret
 
     def script_version(self, script_id):
@@ -286,18 +333,21 @@ class VishopClient(BaseClient):
         version = heading.find_next_sibling('p').string.strip().split(' ')[-1]
         return version
 
-    def update(self, file):
-        if not sys.stdin.isatty():
+    def update(self, file, bundle=None, scripts=None):
+        if not self.args.comment and not sys.stdin.isatty():
             raise VishopError('update must be interactive mode')
 
-        scripts = self.fetch_scripts()
+        if bundle is None:
+            bundle = prepare_bundle(file, self.args.config)
+        if scripts is None:
+            scripts = self.fetch_scripts()
 
         def find_id(name):
             for script in scripts:
                 if script.get('name') == name:
                     return script.get('id')
 
-        config = self.config_from_bundle(file)
+        config = bundle['config']
 
         script_id = find_id(config.get('name'))
         logger.debug('id: %s' % script_id)
@@ -309,10 +359,10 @@ class VishopClient(BaseClient):
         if version in versions:
             raise VishopError("cannot update script: version '%s' already exists!" % version)
 
-        comment = ''
+        comment = self.args.comment
         while not comment:
             try:
-                comment = input('version comment: ')
+                comment = prompt('version comment for %s: ' % file)
             except KeyboardInterrupt:
                 print('cancel', file=sys.stderr)
                 sys.exit(1)
@@ -348,69 +398,63 @@ class VishopClient(BaseClient):
         self.update_headers({
             'Referer': urljoin(self.BASE_URL, 'account', 'index.php')
         })
-        url = urljoin(self.BASE_URL, 'scripts', 'edit_script.php?script_id=%s' % script_id)
-        r = requests.get(url, headers=self.headers)
+        orig_details = self.script_details(script_id)
 
-        if r.status_code != 200:
-            raise VishopError('something goes wrong while fetching script details')
-
-        html = BeautifulSoup(r.text, 'html.parser')
-        logger.debug('html: %s' % html)
-
-        script_name = html.find('input', attrs={'name': 'script_name'})['value']
-        summary = html.find('input', attrs={'name': 'summary'})['value']
-        description = html.find('textarea', attrs={'name': 'description'}).string
-        install_details = html.find('textarea', attrs={'name': 'install_details'}).string
-
-        orig_details = [
-            script_name,
-            summary,
-            description,
-            install_details
-        ]
-
-        details = [
-            config.get('name'),
-            config.get('summary'),
-            self.args.description or config.get('description', self.readme_from_bundle(file)),
-            config.get('install_details', '')
-        ]
+        description = self.args.description or config.get('description')
+        if description is None:
+            if bundle['readme'] is None:
+                raise VishopError('cannot find file from bundle')
+            description = bundle['readme']
+        details = script_details_from_config(config, description)
 
         logger.debug('orig_details: %r' % orig_details)
         logger.debug('details: %r' % details)
 
         # Compare script details
-        is_differ = False
-        for orig, curr in zip(orig_details, details):
-            if orig != curr:
-                is_differ = True
-                break
-        if is_differ:
+        if differ_details(orig_details, details):
             print('updating script details...')
-            # Same url but post method
-            data = {
-                'script_id': script_id,
-                'script_name': details[0],
-                'summary': details[1],
-                'description': details[2],
-                'install_details': details[3],
-                'save': 'update'
-            }
-            r = requests.post(url, data=data, headers=self.headers,
-                              allow_redirects=False)
-            logger.debug('text: %s' % r.text)
-            logger.debug('headers: %r' % r.headers)
-            logger.debug('status_code: %r' % r.status_code)
-            if r.status_code != 302:
-                raise VishopError('something goes wrong while updating script details')
+            self.update_details(script_id, details)
             print('script details updated!')
 
         print('done!')
         print('url:', result_url)
 
-    def upload(self, file):
-        config = self.config_from_bundle(file)
-        description = self.args.description or config.get('description')
+    def script_details(self, script_id):
+        # https://www.vim.org/scripts/edit_script.php?script_id=[id]
+        url = urljoin(self.BASE_URL, 'scripts', 'edit_script.php?script_id=%s' % script_id)
+        r = requests.get(url, headers=self.headers)
+
+        if r.status_code != 200:
+            raise VishopError('something goes wrong while fetching script details')
+
+        html = BeautifulSoup(r.text, 'html.parser')
+        logger.debug('html: %s' % html)
+
+        return {
+            'script_name': html.find('input', attrs={'name': 'script_name'})['value'],
+            'summary': html.find('input', attrs={'name': 'summary'})['value'],
+            'description': html.find('textarea', attrs={'name': 'description'}).string or '',
+            'install_details': html.find('textarea', attrs={'name': 'install_details'}).string or ''
+        }
+
+    def update_details(self, script_id, details):
+        # Same url as fetching details but post method
+        url = urljoin(self.BASE_URL, 'scripts', 'edit_script.php?script_id=%s' % script_id)
+        data = dict(details, script_id=script_id, save='update')
+        r = requests.post(url, data=data, headers=self.headers,
+                          allow_redirects=False)
+        logger.debug('text: %s' % r.text)
+        logger.debug('headers: %r' % r.headers)
+        logger.debug('status_code: %r' % r.status_code)
+        if r.status_code != 302:
+            raise VishopError('something goes wrong while updating script details')
+
+    def upload(self, file, bundle=None):
+        if bundle is None:
+            bundle = prepare_bundle(file, self.args.config)
+        config = bundle['config']
+        description = (self.args.description or config.get('description')
+                       or bundle['readme'])
         if not description:
             wildcard_filter = lambda x: re.match(wildcard(escape('README*')), x)
             files = list(filter(wildcard_filter, os.listdir('.')))
@@ -456,16 +500,346 @@ class VishopClient(BaseClient):
         result_url = r.headers.get('Location')
         print('url:', result_url)
 
-    def publish(self):
-        for file in self.args.files:
-            config = self.config_from_bundle(file)
-            name = config.get('name')
+    def publish(self, files=None, bundles=None, scripts=None):
+        if bundles is None:
+            bundles = [prepare_bundle(file, self.args.config)
+                       for file in files or self.args.files]
+        for bundle in bundles:
+            name = bundle['config'].get('name')
 
-            scripts = self.fetch_scripts()
+            if scripts is None:
+                scripts = self.fetch_scripts()
             if scripts and any(name == script.get('name') for script in scripts):
-                self.update(file)
+                self.update(bundle['path'], bundle=bundle, scripts=scripts)
             else:
-                self.upload(file)
+                self.upload(bundle['path'], bundle=bundle)
+                # Refetch to find id of new script
+                scripts = None
+
+
+def files_from_bundle(bundle_path, files):
+    """Return contents of first members matching each of files.
+
+    Bundle is opened only once. Content is `None` if nothing matches.
+    """
+    filters = [lambda x, file=file: re.search(wildcard(escape(file)), x)
+               for file in files]
+    if re.search(r'\.tar\.[a-z0-9]+$', bundle_path):  # tar file
+        with tarfile.open(bundle_path, 'r') as f:
+            names = f.getnames()
+            ret = []
+            for wildcard_filter in filters:
+                matches = list(filter(wildcard_filter, names))
+                # First match
+                ret.append(f.extractfile(matches[0]).read()
+                           if matches else None)
+            return ret
+    elif re.search(r'\.zip$', bundle_path):  # zip file
+        with zipfile.ZipFile(bundle_path, 'r') as f:
+            names = f.namelist()
+            ret = []
+            for wildcard_filter in filters:
+                matches = list(filter(wildcard_filter, names))
+                # First match
+                ret.append(f.read(matches[0]) if matches else None)
+            return ret
+    raise VishopError("file '%s' is not supported type" % bundle_path)
+
+
+def file_from_bundle(bundle_path, file):
+    content, = files_from_bundle(bundle_path, [file])
+    if content is None:
+        raise VishopError('cannot find file from bundle')
+    return content
+
+
+def config_from_bundle(path, config=CONFIG_FILENAME):
+    return json.loads(file_from_bundle(path, config))
+
+
+def prepare_bundle(path, config_name=CONFIG_FILENAME):
+    """Read everything publishing needs from bundle, without network."""
+    try:
+        size = os.path.getsize(path)
+        if size > int(VishopClient.MAX_FILE_SIZE):
+            raise VishopError("bundle '%s' exceeds maximum file size "
+                              "(%d > %s)"
+                              % (path, size, VishopClient.MAX_FILE_SIZE))
+        config, readme = files_from_bundle(path, [config_name, 'README*'])
+    except (tarfile.TarError, zipfile.BadZipfile, zlib.error, EOFError,
+            IOError, OSError) as err:
+        raise VishopError("cannot read bundle '%s': %s" % (path, err))
+    if config is None:
+        raise VishopError("cannot find '%s' from bundle '%s'"
+                          % (config_name, path))
+    try:
+        config = json.loads(decode_text(config))
+    except ValueError as err:
+        raise VishopError("invalid configuration of bundle '%s': %s"
+                          % (path, err))
+    return {
+        'path': path,
+        'size': size,
+        'config': config,
+        'readme': decode_text(readme) if readme is not None else None
+    }
+
+
+def decode_text(text):
+    if isinstance(text, bytes):
+        return text.decode('utf8')
+    return text
+
+
+DETAIL_FIELDS = ['script_name', 'summary', 'description', 'install_details']
+
+
+def script_details_from_config(config, description):
+    return {
+        'script_name': config.get('name'),
+        'summary': config.get('summary'),
+        'description': description,
+        'install_details': config.get('install_details', '')
+    }
+
+
+def differ_details(orig, details):
+    """Return names of fields which differ, ignoring line endings."""
+    def normalize(value):
+        return (value or '').replace('\r\n', '\n')
+    return [field for field in DETAIL_FIELDS
+            if normalize(orig.get(field)) != normalize(details.get(field))]
+
+
+class VishopClientPool(object):
+    """Clients of each account, logged in at most once."""
+
+    def __init__(self, args, credentials=None):
+        self.args = args
+        self.credentials = credentials or {}
+        self._clients = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def client(self, account=None):
+        with self._lock:
+            if account not in self._clients:
+                if account is None:
+                    client = VishopClient(self.args)
+                else:
+                    if account not in self.credentials:
+                        raise VishopError("credentials of account '%s' "
+                                          "not found" % account)
+                    credential = self.credentials[account]
+                    client = VishopClient(self.args,
+                                          username=credential.get('username'),
+                                          password=credential.get('password'),
+                                          account=account)
+                self._clients[account] = client
+                self._locks[account] = threading.Lock()
+            return self._clients[account], self._locks[account]
+
+    def login(self, account=None):
+        client, lock = self.client(account)
+        with lock:
+            if not client.logged_in:
+                client.login()
+        return client
+
+
+def user_config_dir():
+    base = (os.getenv('XDG_CONFIG_HOME')
+            or os.path.join(os.path.expanduser('~'), '.config'))
+    return os.path.join(base, __title__)
+
+
+def load_credentials(path):
+    """Load account credentials file.
+
+    File maps account names to their credentials. e.g.
+    `{"work": {"username": "foo", "password": "bar"}}`
+    """
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except IOError:
+        return {}
+    except ValueError as err:
+        raise VishopError("invalid credentials file '%s': %s" % (path, err))
+
+
+def print_info(information):
+    print('user name:', information.get('user_name'))
+    print('first name:', information.get('first_name'))
+    print('last name:', information.get('last_name'))
+    print('email:', information.get('email'))
+
+    print('scripts:')
+    for script in information.get('scripts', []):
+        print(' '*2 + '%s: %s' % (script.get('name'), script.get('summary')))
+
+
+def print_versions(name, versions):
+    print('%s:' % name)
+    for version in versions:
+        print(' '*2 + '%s  %s  vim %s  %s  %s' % (
+            version.get('version'), version.get('date'),
+            version.get('required'), version.get('user'),
+            version.get('note')))
+
+
+class ScriptIndex(object):
+    """Local SQLite index of account scripts and their version histories."""
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS accounts (
+            user_name TEXT PRIMARY KEY,
+            first_name TEXT,
+            last_name TEXT,
+            email TEXT,
+            updated_at REAL
+        );
+        CREATE TABLE IF NOT EXISTS scripts (
+            id INTEGER PRIMARY KEY,
+            user_name TEXT,
+            name TEXT,
+            summary TEXT,
+            versions_updated_at REAL
+        );
+        CREATE INDEX IF NOT EXISTS scripts_name ON scripts (name);
+        CREATE TABLE IF NOT EXISTS versions (
+            script_id INTEGER,
+            position INTEGER,
+            version TEXT,
+            package TEXT,
+            date TEXT,
+            required TEXT,
+            user TEXT,
+            note TEXT,
+            PRIMARY KEY (script_id, position)
+        );
+    '''
+
+    def __init__(self, path):
+        import sqlite3
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError:
+            # Already exists
+            pass
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(self.SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def store_info(self, information):
+        """Store account information, dropping scripts no longer listed."""
+        user_name = information.get('user_name')
+        scripts = information.get('scripts', [])
+        with self.connection as c:
+            c.execute('INSERT OR REPLACE INTO accounts VALUES (?, ?, ?, ?, ?)',
+                      (user_name, information.get('first_name'),
+                       information.get('last_name'),
+                       information.get('email'), time.time()))
+            ids = [int(script.get('id')) for script in scripts]
+            for (script_id,) in c.execute(
+                    'SELECT id FROM scripts WHERE user_name = ?',
+                    (user_name,)).fetchall():
+                if script_id not in ids:
+                    c.execute('DELETE FROM versions WHERE script_id = ?',
+                              (script_id,))
+                    c.execute('DELETE FROM scripts WHERE id = ?',
+                              (script_id,))
+            for script in scripts:
+                # Keep timestamp of version history
+                c.execute('INSERT OR IGNORE INTO scripts (id) VALUES (?)',
+                          (int(script.get('id')),))
+                c.execute('UPDATE scripts SET user_name = ?, name = ?, '
+                          'summary = ? WHERE id = ?',
+                          (user_name, script.get('name'),
+                           script.get('summary'), int(script.get('id'))))
+
+    def store_versions(self, script_id, versions):
+        with self.connection as c:
+            c.execute('DELETE FROM versions WHERE script_id = ?',
+                      (int(script_id),))
+            c.executemany(
+                'INSERT INTO versions VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [(int(script_id), position, version.get('version'),
+                  version.get('package'), version.get('date'),
+                  version.get('required'), version.get('user'),
+                  version.get('note'))
+                 for position, version in enumerate(versions)])
+            c.execute('UPDATE scripts SET versions_updated_at = ? '
+                      'WHERE id = ?', (time.time(), int(script_id)))
+
+    def add_version(self, name, version):
+        """Put newly published version on top of indexed version history.
+
+        History is kept marked as stale, so next refresh fetches it from
+        website. Returns `False` if script is not indexed.
+        """
+        row = self.connection.execute(
+            'SELECT id FROM scripts WHERE name = ?', (name,)).fetchone()
+        versions = self.versions(name)
+        if row is None or versions is None:
+            return False
+        self.store_versions(row[0], [version] + versions)
+        with self.connection as c:
+            c.execute('UPDATE scripts SET versions_updated_at = 0 '
+                      'WHERE id = ?', (row[0],))
+        return True
+
+    def stale_scripts(self, max_age=None):
+        """Return ids of scripts whose version history is older than max_age.
+
+        Every script is stale when max_age is `None`.
+        """
+        query = 'SELECT id FROM scripts'
+        params = ()
+        if max_age is not None:
+            query += (' WHERE versions_updated_at IS NULL'
+                      ' OR versions_updated_at < ?')
+            params = (time.time() - max_age,)
+        return [row[0] for row in self.connection.execute(query, params)]
+
+    def infos(self):
+        ret = []
+        for row in self.connection.execute(
+                'SELECT user_name, first_name, last_name, email '
+                'FROM accounts ORDER BY user_name').fetchall():
+            information = dict(zip(
+                ['user_name', 'first_name', 'last_name', 'email'], row))
+            information['scripts'] = [
+                {'id': str(script_id), 'name': name, 'summary': summary}
+                for script_id, name, summary in self.connection.execute(
+                    'SELECT id, name, summary FROM scripts '
+                    'WHERE user_name = ? ORDER BY name', (row[0],))]
+            ret.append(information)
+        return ret
+
+    def script_names(self):
+        return [row[0] for row in self.connection.execute(
+            'SELECT name FROM scripts ORDER BY name')]
+
+    def versions(self, name):
+        """Return version history of script, `None` if not indexed."""
+        row = self.connection.execute(
+            'SELECT id, versions_updated_at FROM scripts WHERE name = ?',
+            (name,)).fetchone()
+        if row is None or row[1] is None:
+            return None
+        fields = ['version', 'package', 'date', 'required', 'user', 'note']
+        return [dict(zip(fields, version))
+                for version in self.connection.execute(
+                    'SELECT %s FROM versions WHERE script_id = ? '
+                    'ORDER BY position' % ', '.join(fields), (row[0],))]
+
+
+def default_index_path():
+    return os.path.join(user_cache_dir(), 'index.sqlite3')
 
 
 def parse_config(config):
@@ -473,6 +847,984 @@ def parse_config(config):
         return json.load(f)
 
 
+def load_local_script(path, config_name=CONFIG_FILENAME):
+    """Load configuration and README of project directory or bundle.
+
+    Description is taken from configuration first, then README as
+    `update` does. `details` is `None` if neither of them is available.
+    """
+    if os.path.isdir(path):
+        config = parse_config(os.path.join(path, config_name))
+        readme_filter = lambda x: re.match(wildcard(escape('README*')), x)
+        readmes = sorted(filter(readme_filter, os.listdir(path)))
+        readme = None
+        if readmes:
+            with open(os.path.join(path, readmes[0]), 'rb') as f:
+                readme = f.read()
+    else:
+        config = config_from_bundle(path, config_name)
+        try:
+            readme = file_from_bundle(path, 'README*')
+        except VishopError:
+            readme = None
+    description = config.get('description')
+    if not description and readme is not None:
+        description = decode_text(readme)
+    return {
+        'path': path,
+        'config': config,
+        'details': (script_details_from_config(config, description)
+                    if description else None)
+    }
+
+
+# Leading bytes of each supported bundle format
+BUNDLE_MAGICS = [
+    ('gz', b'\x1f\x8b'),
+    ('bz2', b'BZh'),
+    ('xz', b'\xfd7zXZ\x00'),
+    ('zip', b'PK\x03\x04'),
+    ('zip', b'PK\x05\x06'),  # Empty archive
+]
+
+CHUNK_SIZE = 64 * 1024
+
+CONFIG_REQUIRED_FIELDS = ['name', 'type', 'version', 'required', 'summary']
+
+
+def bundle_compression(bundle_path):
+    match = re.search(r'\.(tar\.gz|tgz|tar\.bz2|tar\.xz|tar|zip)$', bundle_path)
+    if not match:
+        return None
+    return {
+        'tar.gz': 'gz',
+        'tgz': 'gz',
+        'tar.bz2': 'bz2',
+        'tar.xz': 'xz',
+        'tar': '',
+        'zip': 'zip',
+    }[match.group(1)]
+
+
+def sniff_compression(bundle_path):
+    with open(bundle_path, 'rb') as f:
+        head = f.read(8)
+    for compression, magic in BUNDLE_MAGICS:
+        if head.startswith(magic):
+            return compression
+    return ''
+
+
+def is_unsafe_path(name):
+    if name.startswith('/') or re.match(r'^[A-Za-z]:', name):
+        return True
+    return '..' in re.split(r'[\\/]', name)
+
+
+def is_unsafe_link(info):
+    """Tell whether link member points outside of archive."""
+    if info.issym():
+        # Symbolic link is relative to directory of member
+        target = posixpath.normpath(posixpath.join(
+            posixpath.dirname(info.name), info.linkname))
+        return (posixpath.isabs(target) or target == '..'
+                or target.startswith('../'))
+    # Hard link names member of archive, relative to archive root
+    return is_unsafe_path(info.linkname)
+
+
+class _GzipStreamReader(object):
+    """Decompress gzip stream, counting compressed bytes consumed.
+
+    Compressed input is decompressed only as far as requested output, so
+    `consumed` tells compressed size of everything read so far.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.pending = b''
+        self.consumed = 0
+
+    def read(self, size=-1):
+        if size < 0:
+            size = CHUNK_SIZE
+        output = []
+        while size > 0:
+            if not self.pending:
+                self.pending = self.fileobj.read(CHUNK_SIZE)
+                if not self.pending:
+                    break
+            before = len(self.pending)
+            data = self.decompressor.decompress(self.pending, size)
+            self.pending = self.decompressor.unconsumed_tail
+            unused = self.decompressor.unused_data
+            self.consumed += before - len(self.pending) - len(unused)
+            if unused:
+                # Concatenated gzip member follows
+                self.pending = unused + self.pending
+                self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            output.append(data)
+            size -= len(data)
+        return b''.join(output)
+
+
+def validate_config(config):
+    errors = []
+    if not isinstance(config, dict):
+        return ['configuration must be an object']
+    for field in CONFIG_REQUIRED_FIELDS:
+        if not config.get(field):
+            errors.append("configuration field '%s' required" % field)
+    if config.get('type') and config.get('type') not in SCRIPT_TYPES:
+        errors.append("unknown script type '%s'" % config.get('type'))
+    if config.get('required') and config.get('required') not in VIM_VERSIONS:
+        errors.append("unknown vim version '%s'" % config.get('required'))
+    return errors
+
+
+def check_bundle(bundle_path, config_name=CONFIG_FILENAME):
+    """Validate bundle in single pass of its members.
+
+    Member contents are read in fixed size chunks, so memory usage does not
+    grow with the size of archive. Only configuration file is kept.
+    """
+    report = {
+        'path': bundle_path,
+        'size': 0,
+        'members': [],
+        'errors': [],
+        'warnings': [],
+    }
+    errors = report['errors']
+
+    try:
+        report['size'] = os.path.getsize(bundle_path)
+    except OSError as err:
+        errors.append('cannot read bundle: %s' % err)
+        return report
+
+    if report['size'] > int(VishopClient.MAX_FILE_SIZE):
+        errors.append('bundle exceeds maximum file size (%d > %s bytes)'
+                      % (report['size'], VishopClient.MAX_FILE_SIZE))
+
+    expected = bundle_compression(bundle_path)
+    if expected is None:
+        errors.append("file '%s' is not supported type" % bundle_path)
+        return report
+
+    actual = sniff_compression(bundle_path)
+    if actual != expected:
+        errors.append('bundle compression mismatch: expected %s, found %s'
+                      % (expected or 'uncompressed', actual or 'uncompressed'))
+
+    config_filter = lambda x: re.search(wildcard(escape(config_name)), x)
+    readme_filter = lambda x: re.search(wildcard(escape('README*')), x)
+
+    state = {'config': None, 'readme': False}
+    names = set()
+
+    def visit(name, size, compressed_size, read_chunk):
+        if name in names:
+            errors.append("duplicated member '%s'" % name)
+        names.add(name)
+        if is_unsafe_path(name):
+            errors.append("unsafe member path '%s'" % name)
+
+        collect = state['config'] is None and size and config_filter(name)
+        content = []
+        while True:
+            chunk = read_chunk()
+            if not chunk:
+                break
+            if collect:
+                content.append(chunk)
+        if collect:
+            state['config'] = b''.join(content)
+        if readme_filter(name):
+            state['readme'] = True
+
+        report['members'].append({
+            'name': name,
+            'size': size,
+            'compressed_size': compressed_size(),
+        })
+
+    def visit_tar(f, consumed):
+        for info in f:
+            if info.issym() or info.islnk():
+                if is_unsafe_link(info):
+                    errors.append("unsafe link target '%s' of '%s'"
+                                  % (info.linkname, info.name))
+                visit(info.name, 0, lambda: 0, lambda: b'')
+                continue
+            if not info.isfile():
+                continue
+            if consumed is None:
+                compressed_size = lambda: None
+            elif consumed == 'stored':
+                compressed_size = lambda: info.size
+            else:
+                start = consumed()
+                compressed_size = lambda: consumed() - start
+            member = f.extractfile(info)
+            visit(info.name, info.size, compressed_size,
+                  lambda: member.read(CHUNK_SIZE))
+
+    try:
+        if expected == 'zip':
+            with zipfile.ZipFile(bundle_path, 'r') as f:
+                contents = [info for info in f.infolist() if info.file_size]
+                if contents and all(info.compress_type == zipfile.ZIP_STORED
+                                    for info in contents):
+                    # Not an error, `build -z stored` is deliberate
+                    report['warnings'].append('zip members are not '
+                                              'compressed')
+                for info in f.infolist():
+                    if info.filename.endswith('/'):
+                        continue
+                    with f.open(info) as member:
+                        visit(info.filename, info.file_size,
+                              lambda: info.compress_size,
+                              lambda: member.read(CHUNK_SIZE))
+        elif actual == 'gz':
+            with open(bundle_path, 'rb') as raw:
+                reader = _GzipStreamReader(raw)
+                # Stream mode never seeks backward. Small buffer keeps
+                # compressed bytes attributed to the member being read.
+                with tarfile.open(fileobj=reader, mode='r|',
+                                  bufsize=tarfile.BLOCKSIZE) as f:
+                    visit_tar(f, lambda: reader.consumed)
+        else:
+            # NOTE: bzip2 and xz decompress whole blocks at once, so
+            #       compressed size of each member cannot be told.
+            with tarfile.open(bundle_path, 'r|*') as f:
+                visit_tar(f, None if actual else 'stored')
+    except (tarfile.TarError, zipfile.BadZipfile, zlib.error, EOFError,
+            IOError, OSError) as err:
+        errors.append('corrupted bundle: %s' % err)
+        return report
+
+    if state['config'] is None:
+        errors.append("cannot find '%s' from bundle" % config_name)
+        config = {}
+    else:
+        try:
+            config = json.loads(state['config'].decode('utf8'))
+        except ValueError as err:
+            errors.append('invalid configuration: %s' % err)
+            config = {}
+        else:
+            errors.extend(validate_config(config))
+
+    if not state['readme']:
+        if config.get('description'):
+            report['warnings'].append('README not found from bundle')
+        else:
+            errors.append('README not found and no description configured')
+    return report
+
+
+# Larger files are left to archive writer to avoid holding them in memory
+PREFETCH_MAX_FILE_SIZE = 1024 * 1024
+
+
+class FileItem(object):
+    """File flowing through build pipeline stages.
+
+    `data` holds content read ahead, or transformed by previous stages.
+    It is `None` for non-regular or large files which were not read yet.
+    `stat` and `linkname` are `lstat` result and symlink target, filled by
+    reader threads so that consumer does not have to touch file system.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.stat = None
+        self.linkname = None
+        self.data = None
+        self.error = None
+        self.ready = threading.Event()
+
+    def wait(self):
+        self.ready.wait()
+        if self.error:
+            raise self.error
+        return self
+
+    def read(self):
+        if self.data is not None:
+            return self.data
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+
+def _prefetch_worker(tasks, max_size):
+    while True:
+        item = tasks.get()
+        if item is None:
+            break
+        try:
+            item.stat = os.lstat(item.path)
+            if stat.S_ISLNK(item.stat.st_mode):
+                item.linkname = os.readlink(item.path)
+            elif (stat.S_ISREG(item.stat.st_mode)
+                    and item.stat.st_size <= max_size):
+                with open(item.path, 'rb') as f:
+                    item.data = f.read()
+        except (IOError, OSError) as err:
+            item.error = err
+        finally:
+            item.ready.set()
+
+
+def prefetch(paths, workers=4, depth=16, max_size=PREFETCH_MAX_FILE_SIZE):
+    """Read files ahead of consumer using pool of reader threads.
+
+    Items are yielded in order of `paths`, and at most `depth` files are
+    held in memory at once. Items without `data` (e.g. symlinks or large
+    files) should be read by consumer itself.
+    """
+    if workers < 1:
+        for path in paths:
+            item = FileItem(path)
+            item.ready.set()
+            yield item
+        return
+
+    tasks = queue.Queue(maxsize=depth)
+    threads = []
+    for _ in range(workers):
+        thread = threading.Thread(target=_prefetch_worker,
+                                  args=(tasks, max_size))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    pending = collections.deque()
+    try:
+        for path in paths:
+            item = FileItem(path)
+            pending.append(item)
+            tasks.put(item)
+            if len(pending) >= depth:
+                yield pending.popleft().wait()
+        while pending:
+            yield pending.popleft().wait()
+    finally:
+        for _ in threads:
+            tasks.put(None)
+
+
+# Bump when output of `minify_vim` changes to invalidate cached results
+MINIFY_VIM_VERSION = 3
+
+VIM_COMMENT_RE = re.compile(br'^\s*"')
+# Line continuation, including comment within continuation (`"\ `)
+VIM_CONTINUATION_RE = re.compile(br'^\s*(\\|"\\ )')
+# Any `<<` ending the line starts heredoc (e.g. `let x =<< trim END`,
+# `silent! python3 << EOF`), whatever command or modifier precedes it
+VIM_HEREDOC_RE = re.compile(br'<<((?:\s+(?:trim|eval)\b)*)\s*(\S*)\s*$')
+# `:append`, `:insert` and `:change` followed by text lines
+VIM_APPEND_RE = re.compile(
+    br'(?:^|\|)\s*:*\s*'
+    br'(?:(?:sil(?:e|en|ent)?!?|uns\w*|noa\w*|keep\w*|loc\w*)\s+:*)*'
+    br"(?:[-+\d,;.$%]|'[a-zA-Z<>\[\]]|/[^/]*/|\?[^?]*\?)*\s*"
+    br'(?:a(?:p(?:p(?:e(?:n(?:d)?)?)?)?)?|i(?:n(?:s(?:e(?:r(?:t)?)?)?)?)?'
+    br'|c(?:h(?:a(?:n(?:g(?:e)?)?)?)?)?)!?\s*$')
+# `:def` function, where `"` starts string instead of comment
+VIM_DEF_RE = re.compile(br'^\s*:*\s*(?:export\s+)?def!?(?:\s|$)')
+
+
+def minify_vim(data):
+    """Remove full-line comments and blank lines from vim script.
+
+    Lines followed by line continuation, heredoc bodies and everything after
+    top-level `finish` are kept as is. Vim9 scripts, scripts with `:def`
+    functions, `:append` like text blocks or `<<` not recognized as heredoc,
+    are left untouched.
+    """
+    if re.search(br'^\s*vim9script\b', data, re.M):
+        return data
+
+    lines = data.splitlines(True)
+    output = []
+    heredoc = None
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        if heredoc:
+            output.append(line)
+            marker, trim = heredoc
+            if (line.rstrip(b'\r\n') == marker
+                    or (trim and stripped == marker)):
+                heredoc = None
+            continue
+
+        if line.rstrip(b'\r\n') == b'finish':
+            output.extend(lines[i:])
+            break
+
+        is_comment = VIM_COMMENT_RE.match(line)
+        if ((not stripped or is_comment)
+                and not VIM_CONTINUATION_RE.match(line)):
+            # Removing line right before continuation would join
+            # continued line to different one
+            following = lines[i + 1] if i + 1 < len(lines) else b''
+            if not VIM_CONTINUATION_RE.match(following):
+                continue
+        output.append(line)
+
+        if not is_comment:
+            if VIM_APPEND_RE.search(line) or VIM_DEF_RE.match(line):
+                return data
+            if b'<<' in line:
+                match = VIM_HEREDOC_RE.search(line)
+                if not match:
+                    return data
+                heredoc = (match.group(2) or b'.', b'trim' in match.group(1))
+    return b''.join(output)
+
+
+def is_vim_script(path):
+    parts = os.path.normpath(path).split(os.sep)
+    return path.endswith('.vim') and 'doc' not in parts[:-1]
+
+
+def user_cache_dir():
+    base = (os.getenv('XDG_CACHE_HOME')
+            or os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, __title__)
+
+
+def cached_transform(name, func, data, cache_dir):
+    """Return `func(data)`, reusing result stored by content hash."""
+    key = hashlib.sha256(data).hexdigest()
+    path = os.path.join(cache_dir, name, key[:2], key)
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except (IOError, OSError):
+        pass
+
+    result = func(data)
+    try:
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError:
+            # Already exists
+            pass
+        temp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(temp_path, 'wb') as f:
+            f.write(result)
+        os.rename(temp_path, path)
+    except (IOError, OSError) as err:
+        logger.debug('cannot write cache %s: %s' % (path, err))
+    return result
+
+
+def _is_file(item):
+    st = item.stat
+    if st is None or stat.S_ISLNK(st.st_mode):
+        return os.path.isfile(item.path)
+    return stat.S_ISREG(st.st_mode)
+
+
+def minify_stage(items, cache_dir):
+    # NOTE: Symlinked scripts are minified too, as zip stores their target.
+    #       Tar stores link itself, ignoring data.
+    for item in items:
+        if is_vim_script(item.path) and _is_file(item):
+            item.data = cached_transform(
+                'minify-vim-%d' % MINIFY_VIM_VERSION, minify_vim,
+                item.read(), cache_dir)
+        yield item
+
+
+# Earliest timestamp representable in zip archives (1980-01-01)
+DEFAULT_SOURCE_DATE_EPOCH = 315532800
+
+
+def source_date_epoch():
+    value = os.getenv('SOURCE_DATE_EPOCH')
+    if not value:
+        return DEFAULT_SOURCE_DATE_EPOCH
+    try:
+        return int(value)
+    except ValueError:
+        raise VishopError('invalid SOURCE_DATE_EPOCH: %r' % value)
+
+
+def normalized_mode(mode):
+    if stat.S_ISDIR(mode) or mode & stat.S_IXUSR:
+        return 0o755
+    return 0o644
+
+
+def file_digest(path, data=None):
+    digest = hashlib.sha256()
+    if data is not None:
+        digest.update(data)
+    else:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+@contextlib.contextmanager
+def open_tar_bundle(bundle_path, compression, mtime=None):
+    if compression != 'gz' or mtime is None:
+        with tarfile.open(bundle_path, 'w:%s' % compression,
+                          format=tarfile.GNU_FORMAT) as f:
+            yield f
+        return
+    # NOTE: `tarfile.open` writes current time and file name into gzip header
+    with open(bundle_path, 'wb') as raw:
+        with gzip.GzipFile(filename='', mode='wb',
+                           fileobj=raw, mtime=mtime) as gz:
+            with tarfile.TarFile(fileobj=gz, mode='w',
+                                 format=tarfile.GNU_FORMAT) as f:
+                yield f
+
+
+def archive_name(path):
+    """Return normalized member name of path (e.g. `./a/../b` to `b`)."""
+    return os.path.normpath(os.path.splitdrive(path)[1]).lstrip(os.sep)
+
+
+TAR_TYPES = (
+    (stat.S_ISDIR, tarfile.DIRTYPE),
+    (stat.S_ISFIFO, tarfile.FIFOTYPE),
+    (stat.S_ISLNK, tarfile.SYMTYPE),
+    (stat.S_ISCHR, tarfile.CHRTYPE),
+    (stat.S_ISBLK, tarfile.BLKTYPE),
+)
+
+
+def _owner_name(cache, lookup, id_):
+    if lookup is None:
+        return ''
+    if id_ not in cache:
+        try:
+            cache[id_] = lookup(id_)[0]
+        except KeyError:
+            cache[id_] = ''
+    return cache[id_]
+
+
+def item_tarinfo(f, item, owners):
+    """Return `TarInfo` of item from prefetched stat, like `gettarinfo`.
+
+    Returns `None` for unsupported file types. `owners` caches user and
+    group names looked up while writing one bundle.
+    """
+    try:
+        import pwd
+        import grp
+    except ImportError:  # Windows
+        pwd = grp = None
+
+    st = item.stat if item.stat is not None else os.lstat(item.path)
+    arcname = archive_name(item.path).replace(os.sep, '/')
+    tarinfo = f.tarinfo(arcname)
+    tarinfo.tarfile = f
+    if stat.S_ISREG(st.st_mode):
+        inode = (st.st_ino, st.st_dev)
+        if (st.st_nlink > 1 and inode in f.inodes
+                and arcname != f.inodes[inode]):
+            tarinfo.type = tarfile.LNKTYPE
+            tarinfo.linkname = f.inodes[inode]
+        else:
+            tarinfo.type = tarfile.REGTYPE
+            tarinfo.size = st.st_size
+            if inode[0]:  # Always 0 on Windows
+                f.inodes[inode] = arcname
+    else:
+        for is_type, type_ in TAR_TYPES:
+            if is_type(st.st_mode):
+                tarinfo.type = type_
+                break
+        else:  # Unsupported type (e.g. socket)
+            return None
+        if tarinfo.issym():
+            tarinfo.linkname = (item.linkname if item.linkname is not None
+                                else os.readlink(item.path))
+        elif tarinfo.ischr() or tarinfo.isblk():
+            if hasattr(os, 'major') and hasattr(os, 'minor'):
+                tarinfo.devmajor = os.major(st.st_rdev)
+                tarinfo.devminor = os.minor(st.st_rdev)
+    tarinfo.mode = st.st_mode
+    tarinfo.uid = st.st_uid
+    tarinfo.gid = st.st_gid
+    tarinfo.mtime = st.st_mtime
+    tarinfo.uname = _owner_name(owners.setdefault('user', {}),
+                                pwd and pwd.getpwuid, st.st_uid)
+    tarinfo.gname = _owner_name(owners.setdefault('group', {}),
+                                grp and grp.getgrgid, st.st_gid)
+    return tarinfo
+
+
+def write_tar_bundle(bundle_path, items, compression,
+                     mtime=None, dedupe=False):
+    """Write tar bundle of prefetched items.
+
+    When `mtime` is given, member metadata is normalized so same tree
+    always produces same bytes. With `dedupe`, files with identical content
+    are stored once and added again as hard links.
+    """
+    digests = {}
+    owners = {}
+    with open_tar_bundle(bundle_path, compression, mtime) as f:
+        for item in items:
+            tarinfo = item_tarinfo(f, item, owners)
+            if tarinfo is None:
+                continue
+            if mtime is not None:
+                tarinfo.mtime = mtime
+                tarinfo.uid = tarinfo.gid = 0
+                tarinfo.uname = tarinfo.gname = ''
+                tarinfo.mode = normalized_mode(tarinfo.mode)
+            if not tarinfo.isreg():
+                f.addfile(tarinfo)
+                continue
+            if dedupe:
+                key = (file_digest(item.path, item.data),
+                       tarinfo.mode & stat.S_IXUSR)
+                if key in digests:
+                    tarinfo.type = tarfile.LNKTYPE
+                    tarinfo.linkname = digests[key]
+                    tarinfo.size = 0
+                    f.addfile(tarinfo)
+                    continue
+                digests[key] = tarinfo.name
+            if item.data is not None:
+                tarinfo.size = len(item.data)
+                f.addfile(tarinfo, io.BytesIO(item.data))
+            else:
+                with open(item.path, 'rb') as fileobj:
+                    f.addfile(tarinfo, fileobj)
+
+
+# Compression method id and minimum version to extract of zip codecs
+ZIP_CODECS = collections.OrderedDict([
+    ('stored', (0, 20)),
+    ('deflate', (8, 20)),
+    ('bzip2', (12, 46)),
+    ('lzma', (14, 63)),
+])
+
+# Accepted compression levels of zip codecs, others ignore level
+ZIP_LEVELS = {
+    'deflate': range(0, 10),
+    'bzip2': range(1, 10),
+}
+
+ZIP_UTF8_FLAG = 0x800
+ZIP_LZMA_EOS_FLAG = 0x02
+ZIP_MAX_SIZE = 0xffffffff
+
+
+def zip_compress(data, codec='deflate', level=None):
+    if codec == 'stored':
+        return data
+    elif codec == 'deflate':
+        compressor = zlib.compressobj(
+            zlib.Z_DEFAULT_COMPRESSION if level is None else level,
+            zlib.DEFLATED, -15)
+        return compressor.compress(data) + compressor.flush()
+    elif codec == 'bzip2':
+        import bz2
+        return bz2.compress(data, 9 if level is None else level)
+    elif codec == 'lzma':
+        # NOTE: Like `zipfile`, level has no effect on lzma
+        if not hasattr(zipfile, 'LZMACompressor'):
+            raise VishopError('lzma is not supported on this python')
+        compressor = zipfile.LZMACompressor()
+        return compressor.compress(data) + compressor.flush()
+    raise VishopError("unknown zip compression '%s'" % codec)
+
+
+def _zip_member(item, codec, level, mtime):
+    """Compress item into zip member, on worker thread."""
+    data = item.read()
+    st = item.stat
+    if st is None or not stat.S_ISREG(st.st_mode):  # Follow symlinks
+        st = os.stat(item.path)
+    if mtime is not None:
+        date_time = time.gmtime(max(mtime, DEFAULT_SOURCE_DATE_EPOCH))[:6]
+        mode = normalized_mode(st.st_mode)
+        create_system = 3  # Unix
+    else:
+        date_time = time.localtime(
+            max(st.st_mtime, DEFAULT_SOURCE_DATE_EPOCH))[:6]
+        mode = stat.S_IMODE(st.st_mode)
+        create_system = 0 if sys.platform == 'win32' else 3
+    name = archive_name(item.path).replace(os.sep, '/')
+    if not isinstance(name, bytes):
+        name = name.encode('utf8')
+    compressed = zip_compress(data, codec, level)
+    return {
+        'name': name,
+        'date_time': date_time,
+        'external_attr': (stat.S_IFREG | mode) << 16,
+        'create_system': create_system,
+        'crc': zlib.crc32(data) & 0xffffffff,
+        'size': len(data),
+        'compressed': compressed,
+    }
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            break
+        yield batch
+
+
+def write_zip_bundle(bundle_path, items, mtime=None,
+                     codec='deflate', level=None, jobs=4):
+    """Write zip bundle of prefetched items.
+
+    Members are compressed independently by `jobs` threads, in batches to
+    bound memory, and written in order of items. When `mtime` is given,
+    member metadata is normalized so same tree always produces same bytes.
+    """
+    if codec not in ZIP_CODECS:
+        raise VishopError("unknown zip compression '%s'" % codec)
+    if (level is not None and codec in ZIP_LEVELS
+            and level not in ZIP_LEVELS[codec]):
+        raise VishopError('compression level of %s must be between %d and %d'
+                          % (codec, ZIP_LEVELS[codec][0],
+                             ZIP_LEVELS[codec][-1]))
+    method, version = ZIP_CODECS[codec]
+    compress = lambda item: _zip_member(item, codec, level, mtime)
+
+    from multiprocessing.pool import ThreadPool
+    workers = ThreadPool(max(jobs, 1))
+    entries = []
+    try:
+        with open(bundle_path, 'wb') as f:
+            for batch in _batches(items, max(jobs, 1) * 4):
+                for member in workers.map(compress, batch):
+                    offset = f.tell()
+                    if (offset > ZIP_MAX_SIZE
+                            or member['size'] > ZIP_MAX_SIZE
+                            or len(member['compressed']) > ZIP_MAX_SIZE):
+                        raise VishopError('bundle is too large for zip')
+
+                    name = member['name']
+                    flag_bits = 0
+                    try:
+                        name.decode('ascii')
+                    except UnicodeDecodeError:
+                        flag_bits |= ZIP_UTF8_FLAG
+                    if codec == 'lzma':
+                        flag_bits |= ZIP_LZMA_EOS_FLAG
+
+                    year, month, day, hour, minute, second = member['date_time']
+                    dostime = hour << 11 | minute << 5 | second // 2
+                    dosdate = (year - 1980) << 9 | month << 5 | day
+
+                    f.write(struct.pack(
+                        zipfile.structFileHeader, zipfile.stringFileHeader,
+                        version, 0, flag_bits, method, dostime, dosdate,
+                        member['crc'], len(member['compressed']),
+                        member['size'], len(name), 0))
+                    f.write(name)
+                    f.write(member['compressed'])
+                    entries.append(struct.pack(
+                        zipfile.structCentralDir, zipfile.stringCentralDir,
+                        version, member['create_system'], version, 0,
+                        flag_bits, method, dostime, dosdate, member['crc'],
+                        len(member['compressed']), member['size'],
+                        len(name), 0, 0, 0, 0, member['external_attr'],
+                        offset) + name)
+
+            if len(entries) > 0xffff:
+                raise VishopError('too many files for zip bundle')
+            start = f.tell()
+            for entry in entries:
+                f.write(entry)
+            f.write(struct.pack(
+                zipfile.structEndArchive, zipfile.stringEndArchive,
+                0, 0, len(entries), len(entries),
+                f.tell() - start, start, 0))
+    finally:
+        workers.close()
+
+
+def _scan_dir(dirpath):
+    """Return sorted names of subdirectories and files of directory.
+
+    Like `os.walk`, symbolic links to directories are not descended into.
+    """
+    dirnames, filenames = [], []
+    if scandir is not None:
+        for entry in scandir(dirpath):
+            if entry.is_dir():
+                if not entry.is_symlink():
+                    dirnames.append(entry.name)
+            else:
+                filenames.append(entry.name)
+    else:
+        for name in os.listdir(dirpath):
+            path = os.path.join(dirpath, name)
+            if os.path.isdir(path):
+                if not os.path.islink(path):
+                    dirnames.append(name)
+            else:
+                filenames.append(name)
+    return sorted(dirnames), sorted(filenames)
+
+
+def _scan_tree(root, prune=None):
+    """Yield files under root with keys identifying their directory entry.
+
+    Key is device and inode of parent directory with file name, so same
+    file reached through overlapping or symbolic linked roots has same key,
+    while hard links keep their own.
+    """
+    stack = [root]
+    while stack:
+        dirpath = stack.pop()
+        try:
+            dirnames, filenames = _scan_dir(dirpath)
+            dirstat = os.stat(dirpath)
+        except OSError as err:
+            # Ignored as `os.walk` does
+            logger.debug('cannot scan %s: %s' % (dirpath, err))
+            continue
+        for name in filenames:
+            if name.startswith('.'):
+                continue
+            yield (os.path.join(dirpath, name),
+                   (dirstat.st_dev, dirstat.st_ino, name))
+        subdirs = [os.path.join(dirpath, name) for name in dirnames]
+        if prune:
+            subdirs = [subdir for subdir in subdirs if not prune(subdir)]
+        # Depth first, in sorted order
+        stack.extend(reversed(subdirs))
+
+
+def _scan_worker(root, prune, output):
+    try:
+        for entry in _scan_tree(root, prune):
+            output.put(entry)
+    except Exception as err:
+        output.put(err)
+    finally:
+        output.put(None)
+
+
+def walk_files(roots, prune=None, depth=1024):
+    """Yield files under roots in sorted order, without hidden files.
+
+    Directories matching `prune` are not descended into. Multiple roots are
+    scanned concurrently, each buffering at most `depth` entries, and files
+    already yielded from overlapping roots are skipped.
+    """
+    roots = list(roots)
+    for root in roots:
+        if not os.path.isdir(root):
+            raise VishopError('"%s" is not a directory' % root)
+
+    if len(roots) == 1:
+        for path, _ in _scan_tree(roots[0], prune):
+            yield path
+        return
+
+    # NOTE: Each root has its own thread. Sharing limited number of threads
+    #       could deadlock, since roots are consumed in order.
+    outputs = []
+    for root in roots:
+        output = queue.Queue(maxsize=depth)
+        thread = threading.Thread(target=_scan_worker,
+                                  args=(root, prune, output))
+        thread.daemon = True
+        thread.start()
+        outputs.append(output)
+
+    seen = set()
+    for output in outputs:
+        while True:
+            entry = output.get()
+            if entry is None:
+                break
+            if isinstance(entry, Exception):
+                raise entry
+            path, key = entry
+            if key in seen:
+                logger.debug('%s is duplicated, skipped' % path)
+                continue
+            seen.add(key)
+            yield path
+
+
+def compile_excludes(excludes):
+    """Return predicate which tells whether path matches any of excludes."""
+    # Escape patterns
+    filters = map(escape, excludes)
+    # Remove empty exclude patterns
+    filters = filter(lambda x: x, filters)
+    # Prefix recursive wildcard
+    def prefix(exclude):
+        if exclude.startswith('**'):
+            return exclude
+        return '**%s' % os.path.sep + exclude
+    # Support wildcards
+    patterns = [re.compile('^({0}{1}|{0}$)'.format(pattern, os.path.sep))
+                for pattern in map(wildcard, map(prefix, filters))]
+
+    def is_excluded(path):
+        for pattern in patterns:
+            if pattern.match(path):
+                logger.debug('%r excluded by %r' % (path, pattern.pattern))
+                return True
+        return False
+    return is_excluded
+
+
+def filter_files(files, predicate):
+    for file_ in files:
+        if predicate(file_):
+            yield file_
+
+
+def bundle_sink(bundle_path, type_, mtime=None, dedupe=False,
+                codec='deflate', level=None, jobs=4):
+    """Return archive sink which writes items into bundle of `type_`.
+
+    `codec`, `level` and `jobs` apply to zip bundles.
+    """
+    if type_.startswith('tar'):
+        return lambda items: write_tar_bundle(
+            bundle_path, items, type_.split('.')[-1],
+            mtime=mtime, dedupe=dedupe)
+    elif type_ == 'zip':
+        if dedupe:
+            logger.warning('deduplication is not supported for zip bundles')
+        return lambda items: write_zip_bundle(bundle_path, items,
+                                              mtime=mtime, codec=codec,
+                                              level=level, jobs=jobs)
+    raise VishopError("type '%s' is not supported" % type_)
+
+
+def build_bundle(files, sink, stages=(), jobs=4):
+    """Run build pipeline, streaming files into `sink`.
+
+    Files are read ahead by `jobs` threads, then passed through each of
+    `stages` in order. A stage is callable which takes iterable of
+    `FileItem` and yields them (e.g. generator), which may replace their
+    `data`. Every stage runs lazily, so files are walked only once.
+    """
+    items = prefetch(files, workers=jobs)
+    for stage in stages:
+        items = stage(items)
+    return sink(items)
+
+
 def _init_command(args):
     config = {}
     fields = [
@@ -480,15 +1832,7 @@ def _init_command(args):
         {
             'name': 'type',
             'type': str,
-            'choices': [
-                'color scheme',
-                 'ftplugin',
-                 'game',
-                 'indent',
-                 'syntax',
-                 'utility',
-                 'patch'
-            ]
+            'choices': SCRIPT_TYPES
         },
         {'name': 'required'},
         {'name': 'init_version', 'alias': 'version'},
@@ -567,60 +1911,53 @@ def _info_command(args):
     client.info()
 
 
-def _build_command(args):
-    logger.info('collecting files...')
-    config = parse_config(args.config)
-
-    files = []
-    for path in (args.path or [] + args.paths):
-        if not os.path.isdir(path):
-            raise VishopError('"%s" is not a directory' % path)
-        for dirpath, dirnames, filenames in os.walk(path):
-            for item in filenames:
-                if item.startswith('.'):
+def _index_command(args):
+    if args.action != 'refresh' and not os.path.exists(args.index):
+        raise VishopError("no index found at '%s', run 'vishop index' first"
+                          % args.index)
+    index = ScriptIndex(args.index)
+    try:
+        if args.action == 'info':
+            for information in index.infos():
+                print_info(information)
+            return
+        elif args.action == 'versions':
+            for name in args.names or index.script_names():
+                versions = index.versions(name)
+                if versions is None:
+                    print("script '%s' is not indexed" % name,
+                          file=sys.stderr)
                     continue
-                files.append(os.path.join(dirpath, item))
-
-    # Remove redundant duplicated files
-    files = set(filter(os.path.normpath, files))
-
-    # Exclude items
-    if config.get('excludes') or args.exclude:
-        excludes = config.get('excludes', []) + args.exclude or []
-        # Escape patterns
-        filters = map(escape, excludes)
-        # Remove empty exclude patterns
-        filters = filter(lambda x: x, filters)
-        # Prefix recursive wildcard
-        def prefix(exclude):
-            if exclude.startswith('**'):
-                return exclude
-            return '**%s' % os.path.sep + exclude
-        # Support wildcards
-        filters = map(wildcard, map(prefix, filters))
-
-        # Convert non list variables to list
-        filters = list(filters)
-        files = list(files)
+                print_versions(name, versions)
+            return
 
-        # Filter it
-        filtered = []
-        for file_ in files:
-            for pattern in filters:
-                formatted = '^({0}{1}|{0}$)'.format(pattern, os.path.sep)
-                logger.debug(
-                    '%r %r %r' % (formatted,
-                                  file_,
-                                  bool(re.match(formatted, file_))))
-                if re.match(formatted, file_):
-                    break
-            else:
-                filtered.append(file_)
-        files = filtered
-    files = list(files)
-    logger.debug('files: %s' % files)
+        client = VishopClient(args)
+        client.login()
+        information = client.fetch_info()
+        index.store_info(information)
+
+        max_age = None if args.full else args.max_age
+        stale = index.stale_scripts(max_age)
+        print('fetching version histories of %d script(s)...' % len(stale))
+
+        from multiprocessing.pool import ThreadPool
+        workers = ThreadPool(max(args.jobs, 1))
+        try:
+            # Store from main thread, as connection cannot be shared
+            histories = workers.imap(client.version_history, stale)
+            for script_id, versions in zip(stale, histories):
+                index.store_versions(script_id, versions)
+        finally:
+            workers.close()
+        print('done!')
+    finally:
+        index.close()
 
+
+def _build_command(args):
     logger.info('parsing configuration')
+    config = parse_config(args.config)
+
     def bundle_name(config):
         return '%s-%s.%s' % (
             config.get('name', 'untitled').replace(' ', '-'),
@@ -631,14 +1968,27 @@ def _build_command(args):
     if not args.type:
         raise VishopError('type must be specified')
 
-    if not files:
-        raise VishopError('at least 1 file required')
+    bundle_path = os.path.join(args.output, bundle_name(config))
+
+    logger.info('collecting files...')
+    is_excluded = compile_excludes(config.get('excludes', [])
+                                   + (args.exclude or []))
+    files = walk_files((args.path or []) + (args.paths or []),
+                       prune=is_excluded)
+    files = filter_files(
+        files,
+        lambda file_: (not is_excluded(file_)
+                       # Never archive bundle itself
+                       and os.path.abspath(file_) != os.path.abspath(bundle_path)))
 
     if args.interactive:
+        files = list(files)
+        if not files:
+            raise VishopError('at least 1 file required')
+
         print('following files will be archived')
         print()
 
-        # files = sorted(files)
         print('\n'.join(files[:args.limit]))
 
         if len(files) > args.limit:
@@ -651,36 +2001,241 @@ def _build_command(args):
             pass
         else:
             return 1
+    else:
+        first = next(files, None)
+        if first is None:
+            raise VishopError('at least 1 file required')
+        files = itertools.chain([first], files)
 
-    bundle_path = os.path.join(args.output, bundle_name(config))
     try:
         os.makedirs(os.path.dirname(bundle_path))
     except OSError:
         # Already exists
         pass
 
-    if args.type.startswith('tar'):
-        # mode = ''
-        # if args.type == 'tar':
-        #     mode = 'w'
-        # else:
-        #     mode = 'w:%s' % args.type.split('.')[-1]
-        with tarfile.TarFile(bundle_path, 'w',
-                             format=tarfile.GNU_FORMAT) as f:
-            for file_ in files:
-                f.add(file_)
-    elif args.type == 'zip':
-        with zipfile.ZipFile(bundle_path, 'w') as f:
-            for file_ in files:
-                f.write(file_)
+    stages = []
+    if config.get('minify'):
+        logger.info('minifying vim scripts')
+        stages.append(lambda items: minify_stage(items, user_cache_dir()))
+
+    reproducible = args.reproducible or config.get('reproducible', False)
+    mtime = source_date_epoch() if reproducible else None
+    dedupe = args.dedupe or config.get('dedupe', False)
+    sink = bundle_sink(bundle_path, args.type, mtime=mtime, dedupe=dedupe,
+                       codec=args.zip_compression,
+                       level=args.compress_level, jobs=args.jobs)
+    build_bundle(files, sink, stages=stages, jobs=args.jobs)
+
+    print('done!')
+
 
+def _check_command(args):
+    failed = 0
+    for file in args.files:
+        report = check_bundle(file, args.config)
+        print('%s (%d bytes)' % (file, report['size']))
+        if args.verbose or args.members:
+            def print_row(size, compressed_size, name):
+                ratio = ('%6.2f' % (size / compressed_size)
+                         if compressed_size else '%6s' % '-')
+                if compressed_size is None:
+                    compressed_size = '-'
+                print(' '*2 + '%10s %10s %s  %s' % (
+                    size, compressed_size, ratio, name))
+            for member in report['members']:
+                print_row(member['size'], member['compressed_size'],
+                          member['name'])
+            if report['members']:
+                print_row(sum(member['size'] for member in report['members']),
+                          report['size'], '(bundle)')
+        for warning in report['warnings']:
+            print(' '*2 + 'warning: %s' % warning)
+        for error in report['errors']:
+            print(' '*2 + 'error: %s' % error)
+        if report['errors']:
+            failed += 1
+    print()
+    if failed:
+        print('%d of %d bundle(s) failed' % (failed, len(args.files)))
+        return 1
     print('done!')
 
 
 def _publish_command(args):
-    client = VishopClient(args)
-    client.login()
-    client.publish()
+    from multiprocessing.pool import ThreadPool
+    pool = VishopClientPool(args, load_credentials(args.credentials))
+
+    def prepare(file):
+        return prepare_bundle(file, args.config)
+
+    def login(account):
+        client = pool.login(account)
+        return client, client.fetch_scripts()
+
+    # Bundles are prepared concurrently, and login of each account starts
+    # as soon as first bundle of the account is ready. When checking against
+    # local index, logins wait until every bundle has passed the check, so
+    # conflicting version fails before any network call.
+    index = None
+    if not args.no_index and os.path.exists(args.index):
+        index = ScriptIndex(args.index)
+
+    workers = ThreadPool(max(args.jobs, 1))
+    sessions = ThreadPool(max(args.jobs, 1))
+    errors = []
+    try:
+        accounts = collections.OrderedDict()
+        logins = {}
+
+        def schedule_login(account):
+            if account not in logins:
+                # Ask credentials from main thread
+                pool.client(account)
+                logins[account] = sessions.apply_async(login, (account,))
+
+        for bundle in workers.imap(prepare, args.files):
+            config = bundle['config']
+            if index is not None:
+                versions = index.versions(config.get('name')) or []
+                if any(config.get('version') == version.get('version')
+                       for version in versions):
+                    raise VishopError("cannot update script: version '%s' "
+                                      "of '%s' already exists! (indexed)"
+                                      % (config.get('version'),
+                                         config.get('name')))
+            account = config.get('account')
+            accounts.setdefault(account, []).append(bundle)
+            if index is None:
+                schedule_login(account)
+        for account in accounts:
+            schedule_login(account)
+
+        def publish(account):
+            client, scripts = logins[account].get()
+            client.publish(bundles=accounts[account], scripts=scripts)
+
+        if len(accounts) == 1:
+            publish(list(accounts)[0])
+            published = list(accounts)
+        else:
+            def try_publish(account):
+                try:
+                    publish(account)
+                except VishopError as err:
+                    return '%s: %s' % (account or 'default account', err)
+
+            publishers = ThreadPool(len(accounts))
+            try:
+                results = publishers.map(try_publish, accounts)
+            finally:
+                publishers.close()
+            errors = [err for err in results if err]
+            published = [account for account, err in zip(accounts, results)
+                         if not err]
+
+        if index is not None:
+            # NOTE: Newly uploaded scripts are left to next refresh of index
+            for account in published:
+                for bundle in accounts[account]:
+                    config = bundle['config']
+                    index.add_version(config.get('name'), {
+                        'version': config.get('version'),
+                        'package': os.path.basename(bundle['path']),
+                        'required': config.get('required'),
+                    })
+    finally:
+        if index is not None:
+            index.close()
+        workers.close()
+        sessions.close()
+    if errors:
+        raise VishopError('\n'.join(errors))
+
+
+def _sync_command(args):
+    from multiprocessing.pool import ThreadPool
+    workers = ThreadPool(max(args.jobs, 1))
+    try:
+        local_scripts = workers.map(
+            lambda path: load_local_script(path, args.config), args.paths)
+
+        accounts = collections.OrderedDict()
+        for script in local_scripts:
+            if script['details'] is None:
+                # Never wipe description on website
+                print('%s: description required, skipped'
+                      % script['config'].get('name'))
+                continue
+            account = script['config'].get('account')
+            accounts.setdefault(account, []).append(script)
+
+        pool = VishopClientPool(args, load_credentials(args.credentials))
+        # Ask credentials up front, before running concurrently
+        for account in accounts:
+            pool.client(account)
+
+        def fetch_ids(account):
+            client = pool.login(account)
+            ids = dict((script.get('name'), script.get('id'))
+                       for script in client.fetch_scripts())
+            client.update_headers({
+                'Referer': urljoin(client.BASE_URL, 'account', 'index.php')
+            })
+            return client, ids
+        clients = dict(zip(accounts, workers.map(fetch_ids, accounts)))
+
+        targets = []
+        for account, scripts in accounts.items():
+            client, ids = clients[account]
+            for script in scripts:
+                name = script['details']['script_name']
+                if name not in ids:
+                    print('%s: not published yet, skipped' % name)
+                    continue
+                targets.append((client, ids[name], script))
+
+        remote_details = workers.map(
+            lambda target: target[0].script_details(target[1]), targets)
+
+        changes = []
+        for target, orig in zip(targets, remote_details):
+            client, script_id, script = target
+            details = script['details']
+            fields = differ_details(orig, details)
+            if not fields:
+                logger.info('%s: up to date' % details['script_name'])
+                continue
+            print('%s: %s' % (details['script_name'], ', '.join(fields)))
+            if args.dry_run:
+                import difflib
+                for field in fields:
+                    diff = difflib.unified_diff(
+                        (orig.get(field) or '').splitlines(),
+                        (details.get(field) or '').splitlines(),
+                        fromfile='%s (vim.org)' % field,
+                        tofile='%s (%s)' % (field, script['path']),
+                        lineterm='')
+                    for line in diff:
+                        print(' '*2 + line)
+            changes.append(target)
+
+        if args.dry_run or not changes:
+            print('%d script(s) to update' % len(changes))
+            return
+
+        def update(target):
+            client, script_id, script = target
+            try:
+                client.update_details(script_id, script['details'])
+            except VishopError as err:
+                return '%s: %s' % (script['details']['script_name'], err)
+        errors = [err for err in workers.map(update, changes) if err]
+    finally:
+        workers.close()
+    if errors:
+        raise VishopError('\n'.join(errors))
+    print('%d script(s) updated' % len(changes))
+    print('done!')
 
 
 def _clean_command(args):
@@ -701,6 +2256,10 @@ def main():
         pass
 
 
+    default_credentials = os.getenv(
+        'VISHOP_CREDENTIALS',
+        os.path.join(user_config_dir(), 'credentials.json'))
+
     import argparse
     common_parser = argparse.ArgumentParser(add_help=False)
     common_parser.add_argument('--verbose', '-v', action='count', default=0,
@@ -721,25 +2280,11 @@ def main():
                              default=CONFIG_FILENAME)
     init_parser.add_argument('--name', '-n')
     init_parser.add_argument('--type', '-t',
-                             choices=[
-                                 'color scheme',
-                                 'ftplugin',
-                                 'game',
-                                 'indent',
-                                 'syntax',
-                                 'utility',
-                                 'patch'])
+                             choices=SCRIPT_TYPES)
     init_parser.add_argument('--required', '-r',
                              type=str,
                              default='7.0',
-                             choices=[
-                                 "5.7",
-                                 "6.0",
-                                 "7.0",
-                                 "7.2",
-                                 "7.3",
-                                 "7.4",
-                                 "8.0"])
+                             choices=VIM_VERSIONS)
     init_parser.add_argument('--init-version', '-V', type=str, default='1.0')
     init_parser.add_argument('--summary', '-s', type=str)
     init_parser.add_argument('--description', '-d', type=str)
@@ -786,6 +2331,25 @@ def main():
                               ],
                               help='set output file type')
     build_parser.add_argument('--output', '-o', type=str, default='dist')
+    build_parser.add_argument('--jobs', '-j', type=int, default=4,
+                              help='number of threads reading files ahead '
+                                   'of archiving, also compressing zip '
+                                   'members. 0 to disable reading ahead')
+    build_parser.add_argument('--reproducible', '-R', action='store_true',
+                              help='normalize metadata of members. '
+                                   'SOURCE_DATE_EPOCH is used '
+                                   'for timestamps')
+    build_parser.add_argument('--dedupe', '-D', action='store_true',
+                              help='store identical files once '
+                                   '(tar bundles only)')
+    build_parser.add_argument('--zip-compression', '-z',
+                              default='deflate',
+                              choices=list(ZIP_CODECS),
+                              help='compression of zip bundle members '
+                                   '(default: "deflate")')
+    build_parser.add_argument('--compress-level', '-L', type=int,
+                              help='compression level of zip bundle '
+                                   'members. ignored by lzma')
     build_parser.add_argument('paths', nargs='*')
     build_parser.set_defaults(func=_build_command)
 
@@ -797,9 +2361,70 @@ def main():
     publish_parser.add_argument('--password', '-p')
     publish_parser.add_argument('--description', '-d')
     publish_parser.add_argument('--interactive', '-i', action='store_true')
-    publish_parser.add_argument('files', action='append')
+    publish_parser.add_argument('--jobs', '-j', type=int, default=4,
+                                help='number of bundles prepared '
+                                     'concurrently')
+    publish_parser.add_argument('--comment', '-m',
+                                help='version comment of updated scripts')
+    publish_parser.add_argument('--credentials', '-C',
+                                default=default_credentials,
+                                help='credentials file of accounts '
+                                     'referred by "account" of bundle '
+                                     'configurations')
+    publish_parser.add_argument('--index', default=default_index_path(),
+                                help='check version conflicts against '
+                                     'this index before publishing')
+    publish_parser.add_argument('--no-index', action='store_true',
+                                help='do not check version conflicts '
+                                     'against index')
+    publish_parser.add_argument('files', nargs='+')
     publish_parser.set_defaults(func=_publish_command)
 
+    check_parser = subparsers.add_parser('check', parents=[common_parser],
+                                         help='validate plugin bundles')
+    check_parser.add_argument('--members', '-m', action='store_true',
+                              help='show size and compression ratio '
+                                   'of each member')
+    check_parser.add_argument('files', nargs='+')
+    check_parser.set_defaults(func=_check_command)
+
+    index_parser = subparsers.add_parser('index', parents=[common_parser],
+                                         help='refresh or query local index '
+                                              'of scripts and versions')
+    index_parser.add_argument('action', nargs='?', default='refresh',
+                              choices=['refresh', 'info', 'versions'],
+                              help='refresh index from website, or query '
+                                   'it offline (default: refresh)')
+    index_parser.add_argument('names', nargs='*',
+                              help='script names to show versions of')
+    index_parser.add_argument('--username', '-u')
+    index_parser.add_argument('--password', '-p')
+    index_parser.add_argument('--index', default=default_index_path(),
+                              help='path of index database')
+    index_parser.add_argument('--full', '-F', action='store_true',
+                              help='refetch all version histories')
+    index_parser.add_argument('--max-age', type=int, default=24 * 60 * 60,
+                              help='refetch version histories older than '
+                                   'this seconds (default: one day)')
+    index_parser.add_argument('--jobs', '-j', type=int, default=4,
+                              help='number of concurrent requests')
+    index_parser.set_defaults(func=_index_command)
+
+    sync_parser = subparsers.add_parser('sync', parents=[common_parser],
+                                        help='update script details of '
+                                             'published plugins')
+    sync_parser.add_argument('--username', '-u')
+    sync_parser.add_argument('--password', '-p')
+    sync_parser.add_argument('--credentials', '-C',
+                             default=default_credentials)
+    sync_parser.add_argument('--dry-run', '-n', action='store_true',
+                             help='show differences without updating')
+    sync_parser.add_argument('--jobs', '-j', type=int, default=4,
+                             help='number of concurrent requests')
+    sync_parser.add_argument('paths', nargs='+',
+                             help='plugin directories or bundles')
+    sync_parser.set_defaults(func=_sync_command)
+
     clean_parser = subparsers.add_parser('clean')
     clean_parser.add_argument('--interactive', '-i', action='store_true')
     clean_parser.add_argument('--path', '-p', type=str, default='dist')
@@ -827,14 +2452,15 @@ def main():
             build_parser.error('at least one file or path required')
 
     try:
-        args.func(args)
+        return args.func(args)
     except VishopError as err:
         if args.verbose == 2:
             import traceback
             print(traceback.format_exc(), file=sys.stderr)
         print(err, file=sys.stderr)
+        return 1
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
 